@@ -6,8 +6,12 @@ Contiene le funzioni necessarie per analizzare l'andamento medio del profilo lon
 
 import numpy as np
 import sciame
+from itertools import islice
 
-def profilo_medio(E0, ec_elettrone, ec_positrone, dE_X0, s, tipo, n, X0):
+OSSERVABILI = ['En', 'n_max', 'dist_max', 'massimo']
+CHIAVI = [chiave + suffisso for chiave in OSSERVABILI for suffisso in ['', '_err']]
+
+def profilo_medio(E0, ec_elettrone, ec_positrone, dE_X0, s, tipo, n, X0, bordi = None, profondita_max = None, libreria = None):
 	
 	"""
 	Simula uno sciame più volte e ne calcola i valori medi.
@@ -21,6 +25,9 @@ def profilo_medio(E0, ec_elettrone, ec_positrone, dE_X0, s, tipo, n, X0):
 		tipo (str): Tipo della particella iniziale (elettrone, positrone, fotone)
 		n (int): Numero di simulazioni da eseguire
 		X0 (float): Lunghezza di radiazione [cm]
+		bordi (array, opzionale): Bordi dei bin di energia degli spettri, strettamente crescenti (es. np.logspace) [MeV]
+		profondita_max (float, opzionale): Profondità oltre la quale gli sciami non vengono simulati (in unità di X0)
+		libreria (LibreriaSciami, opzionale): Libreria di sottosciami pre-simulati per il materiale in esame (vedi libreria_sciame)
 	
 	Ritorna:
 	risultati (dict): contiene
@@ -31,16 +38,46 @@ def profilo_medio(E0, ec_elettrone, ec_positrone, dE_X0, s, tipo, n, X0):
         - 'E_cum_med' (list): Energia cumulata media [MeV]
         - 'E_cum_err' (list): Errore standard dell'energia cumulata media [MeV]
         - 'distanza' (list): Coordinata longitudinale dello sciame (in unità di X0)
+        Solo se 'bordi' è specificato:
+        - 'spettro_med' (np.array): Numero medio di particelle per ogni passo, tipo (nell'ordine di sciame.TIPI) e bin di energia
+        - 'spettro_err' (np.array): Errore standard dello spettro medio
+        - 'bordi' (np.array): Bordi dei bin di energia [MeV]
 	"""
 	if n <= 0:
 		raise ValueError(f'Il numero n di simulazioni da ripetere per ogni valore di energia deve essere positivo')
 	
+	if profondita_max is not None and profondita_max < 0:
+		raise ValueError("La profondità massima 'profondita_max' deve essere positiva")
+	
 	Energia = []
 	n_particelle = []
+	
+	if bordi is not None:
+		somma = np.zeros((0, len(sciame.TIPI), len(bordi) - 1))      #Somma e somma dei quadrati degli spettri, accumulate sul posto
+		somma2 = np.zeros((0, len(sciame.TIPI), len(bordi) - 1))
+	
+	n_passi = None if profondita_max is None else int(np.floor(profondita_max / s + 1e-9)) + 1     #Step fino a profondita_max compreso
 
 	for i in range(n):
 		
-		E_step, n_part, E_tot = sciame.simulazione(E0, ec_elettrone, ec_positrone, dE_X0, s, tipo, X0)
+		E_step = []
+		n_part = []
+		
+		passi = sciame.simulazione_passi(E0, ec_elettrone, ec_positrone, dE_X0, s, tipo, X0, bordi, libreria, per_tipo = False)
+		
+		for record in islice(passi, n_passi):
+			
+			E_step.append(record['E_ion'])
+			n_part.append(record['n_part'])
+			
+			if bordi is not None:
+				
+				if record['passo'] == len(somma):
+					somma = np.pad(somma, ((0, 1), (0, 0), (0, 0)))
+					somma2 = np.pad(somma2, ((0, 1), (0, 0), (0, 0)))
+				
+				somma[record['passo']] += record['spettro']
+				somma2[record['passo']] += record['spettro']**2
 		
 		Energia.append(E_step)
 		n_particelle.append(n_part)
@@ -72,15 +109,119 @@ def profilo_medio(E0, ec_elettrone, ec_positrone, dE_X0, s, tipo, n, X0):
 				 'E_cum_med': E_cum_med,
 				 'E_cum_err': E_cum_err,
 				 'distanza': distanza}	
+	
+	if bordi is not None:
+		spettro_med = somma / n
+		risultati['spettro_med'] = spettro_med
+		risultati['spettro_err'] = np.sqrt(np.maximum(somma2 - n * spettro_med**2, 0) / (n - 1)) / np.sqrt(n)
+		risultati['bordi'] = np.asarray(bordi)
 		
 	return risultati
 
 
 
-def sciame_stat(E0_min, E0_max, materiali, s, tipo, nE, n):
+def _parametri_energia(E0, parametri, s, tipo, n, libreria = None):
+
+	"""
+	Simula n sciami ad una singola energia iniziale in un materiale e ne calcola i parametri medi.
+
+	Parametri:
+		E0 (float): Energia della particella iniziale [MeV]
+		parametri (list): Parametri del materiale [ec_elettrone, ec_positrone, dE_X0, X0, colore]
+		s (float): Passo di avanzamento della simulazione in frazioni di X0 (s in (0, 1])
+		tipo (str): Tipo della particella iniziale (elettrone, positrone, fotone)
+		n (int): Numero di simulazioni da eseguire
+		libreria (LibreriaSciami, opzionale): Libreria di sottosciami pre-simulati per il materiale in esame
+
+	Ritorna:
+		valori (dict): Contiene per ogni chiave di OSSERVABILI il valore medio e per ogni chiave con suffisso '_err' il suo errore standard
+	"""
+
+	En_simulazione = []   		 # n energie depositate per una E0
+	n_max_simulazione = []		 # n numeri massimi di particelle per una E0
+	n_passi = []		 		 # n numeri di passi eseguiti per una E0
+	indice_massimo = []	 		 # n indici dove si trova il valore del massimo per una E0
+
+	for j in range(n):
+		
+		E_tot = 0
+		n_max = 0
+		i_max = 0
+		
+		for record in sciame.simulazione_passi(E0, parametri[0], parametri[1], parametri[2], s, tipo, parametri[3], libreria = libreria, per_tipo = False):     #Massimo e profondità calcolati passo per passo
+			
+			E_tot += record['E_ion']
+			
+			if record['n_part'] > n_max:
+				n_max = record['n_part']
+				i_max = record['passo']
+
+		En_simulazione.append(E_tot)
+		n_max_simulazione.append(n_max)
+		n_passi.append(record['passo'] + 1)
+		indice_massimo.append(i_max)
+
+	valori = {'En': np.mean(En_simulazione),
+			  'En_err': np.std(En_simulazione, ddof = 1)/np.sqrt(n),
+			  'n_max': np.mean(n_max_simulazione),
+			  'n_max_err': np.std(n_max_simulazione, ddof = 1)/np.sqrt(n),
+			  'dist_max': np.mean(n_passi) * s * parametri[3],
+			  'dist_max_err': (np.std(n_passi, ddof = 1)/np.sqrt(n)) * s * parametri[3],
+			  'massimo': np.mean(indice_massimo) * s * parametri[3],
+			  'massimo_err': (np.std(indice_massimo, ddof = 1)/np.sqrt(n)) * s * parametri[3]}
+
+	return valori
+
+
+
+def _errore_interpolazione(Energie, y, y_err):
+
+	"""
+	Stima, per ogni intervallo della griglia di energie, l'errore commesso interpolando linearmente (in log E0) un osservabile.
+	Per ogni punto interno si confronta il valore simulato con l'interpolazione dei due punti vicini e si sottrae la
+	parte della differenza compatibile con gli errori statistici (2 sigma). Il risultato è normalizzato al valore massimo dell'osservabile.
+
+	Parametri:
+		Energie (np.array): Energie della griglia, ordinate in modo crescente [MeV]
+		y (list): Valori medi dell'osservabile per ogni energia
+		y_err (list): Errori standard dell'osservabile per ogni energia
+
+	Ritorna:
+		errore (np.array): Errore relativo stimato per ognuno dei len(Energie) - 1 intervalli
+	"""
+
+	x = np.log10(Energie)
+	y = np.asarray(y, dtype = float)
+	y_err = np.asarray(y_err, dtype = float)
+
+	scala = np.max(np.abs(y))
+	errore_punti = np.zeros(len(x))
+
+	if scala > 0:
+
+		for i in range(1, len(x) - 1):
+
+			w = (x[i] - x[i-1]) / (x[i+1] - x[i-1])
+			y_int = (1 - w) * y[i-1] + w * y[i+1]
+			sigma = np.sqrt(y_err[i]**2 + ((1 - w) * y_err[i-1])**2 + (w * y_err[i+1])**2)
+
+			errore_punti[i] = max(abs(y[i] - y_int) - 2 * sigma, 0) / scala
+
+	errore = np.maximum(errore_punti[:-1], errore_punti[1:])
+
+	return errore
+
+
+
+def sciame_stat(E0_min, E0_max, materiali, s, tipo, nE, n, adattivo = False, tol = 0.05, n_sim_max = None, librerie = None):
 	
 	"""
 	Esegue più simulazioni dello sciame per diversi valori di energia spaziati logaritmicamente nell'intervallo dato.
+
+	Se 'adattivo' è True, le nE energie costituiscono una griglia iniziale che viene raffinata aggiungendo il punto medio
+	(in scala logaritmica) dell'intervallo in cui l'errore di interpolazione stimato è maggiore, considerando tutti gli
+	osservabili e tutti i materiali. Il raffinamento termina quando l'errore di ogni intervallo è minore di 'tol'
+	o quando un nuovo punto porterebbe a superare 'n_sim_max' simulazioni totali.
 	
 	Parametri:
 		E0_min (float): Valore minimo dell'intervallo di energie in cui vengono eseguite le simulazioni [MeV]
@@ -94,11 +235,16 @@ def sciame_stat(E0_min, E0_max, materiali, s, tipo, nE, n):
 			-colore (str): Colore da utilizzare per rappresentare nei grafici il materiale 
 		s (float): Passo di avanzamento della simulazione in frazioni di X0 (s in (0, 1])
 		tipo (str): Tipo della particella iniziale (elettrone, positrone, fotone)
-		nE (int): Numero di valori di energia da considerare nell'intervallo scelto
+		nE (int): Numero di valori di energia da considerare nell'intervallo scelto (griglia iniziale se 'adattivo' è True)
 		n (int): Numero di simulazioni da eseguire per ogni valore di energia
+		adattivo (bool, opzionale): Se True la griglia di energie viene raffinata in modo adattivo
+		tol (float, opzionale): Errore di interpolazione relativo massimo accettato nella modalità adattiva
+		n_sim_max (int, opzionale): Numero massimo di simulazioni totali nella modalità adattiva (default: 4 * nE * n * numero di materiali)
+		librerie (dict, opzionale): Per ogni nome di materiale la libreria di sottosciami pre-simulati da utilizzare (vedi libreria_sciame).
+			I materiali senza libreria vengono simulati completamente
 	
 	Ritorna:
-		Energie (np.array): Contiene le nE energie utilizzate.
+		Energie (np.array): Contiene le energie utilizzate, in ordine crescente.
 		risultati (dict): Contiene i risultati  per ogni materiale.
 				Ogni chiave è il nome del materiale (str) e il valore è un dict contenente:
 				-'En' (list): energia totale media depositata per ionizzazione per ogni valore di energia [MeV]
@@ -121,6 +267,24 @@ def sciame_stat(E0_min, E0_max, materiali, s, tipo, nE, n):
 	if nE <= 0 or n <= 0:
 		raise ValueError("'nE' e 'n' devono essere entrambi positivi")
 		
+	if adattivo and nE < 3:
+		raise ValueError("Nella modalità adattiva 'nE' deve essere almeno 3")
+
+	if adattivo and n < 2:
+		raise ValueError("Nella modalità adattiva 'n' deve essere almeno 2 per stimare gli errori")
+
+	if adattivo and E0_max <= E0_min:
+		raise ValueError("Nella modalità adattiva inserire 'E0_min' < 'E0_max'")
+
+	if adattivo and tol <= 0:
+		raise ValueError("La tolleranza 'tol' deve essere positiva")
+
+	if adattivo and n_sim_max is not None and n_sim_max <= 0:
+		raise ValueError("Il numero massimo di simulazioni 'n_sim_max' deve essere positivo")
+
+	if librerie is None:
+		librerie = {}
+
 	risultati = {}
 	
 	esponente_min = np.log10(E0_min)
@@ -129,57 +293,56 @@ def sciame_stat(E0_min, E0_max, materiali, s, tipo, nE, n):
 	
 	for materiale in materiali:
 		
-		En = []                 #Energia media depositata per ogni E0
-		En_err = []
-				
-		n_max = []				#Numero massimo medio di particelle per ogni E0
-		n_max_err = []
-			
-		dist_max = []			#Distanza massima media raggiunta dallo sciame per ogni E0
-		dist_max_err = []
-				
-		massimo = []			#Distanza media alla quale si trova il massimo dello sciame per ogni E0
-		massimo_err = []
+		risultati[materiale] = {chiave: [] for chiave in CHIAVI}
 
 		for i in range(nE):
 				
-			En_simulazione = []   		 # n energie depositate per una E0
-			n_max_simulazione = []		 # n numeri massimi di particelle per una E0
-			n_passi = []		 		 # n numeri di passi eseguiti per una E0
-			indice_massimo = []	 		 # n indici dove si trova il valore del massimo per una E0 
+			valori = _parametri_energia(Energie[i], materiali[materiale], s, tipo, n, librerie.get(materiale))
 				
+			for chiave in CHIAVI:
+				risultati[materiale][chiave].append(valori[chiave])
 				
-			for j in range(n):
-					
-				E_step, n_part, E_tot = sciame.simulazione(Energie[i], materiali[materiale][0], materiali[materiale][1], materiali[materiale][2] , s, tipo, materiali[materiale][3])
+	if adattivo:
 
-				En_simulazione.append(E_tot)
-				n_max_simulazione.append(np.max(n_part))
-				n_passi.append(len(n_part))
-				indice_massimo.append(np.argmax(n_part))
+		if n_sim_max is None:
+			n_sim_max = 4 * nE * n * len(materiali)
+
+		n_sim = nE * n * len(materiali)
 					
+		while n_sim + n * len(materiali) <= n_sim_max:
 				
-			En.append(np.mean(En_simulazione))
-			En_err.append(np.std(En_simulazione, ddof = 1)/np.sqrt(n))
+			errore = np.zeros(len(Energie) - 1)
 				
-			n_max.append(np.mean(n_max_simulazione))
-			n_max_err.append(np.std(n_max_simulazione, ddof = 1)/np.sqrt(n))
+			for materiale in materiali:
+				for osservabile in OSSERVABILI:
 
-			dist_max.append(np.mean(n_passi) * s * materiali[materiale][3])
-			dist_max_err.append((np.std(n_passi, ddof = 1)/np.sqrt(n)) * s * materiali[materiale][3])
+					y = np.asarray(risultati[materiale][osservabile])
+					y_err = np.asarray(risultati[materiale][osservabile + '_err'])
 			
-			massimo.append(np.mean(indice_massimo) * s * materiali[materiale][3])
-			massimo_err.append((np.std(indice_massimo, ddof = 1)/np.sqrt(n)) * s * materiali[materiale][3])
+					if osservabile == 'En':     #Si interpola la frazione di E0 depositata, come nei grafici
+						y = y / Energie
+						y_err = y_err / Energie
 			
+					errore = np.maximum(errore, _errore_interpolazione(Energie, y, y_err))
 			
-		risultati[materiale] = {'En': En,
-								'En_err': En_err,
-								'n_max': n_max,
-								'n_max_err': n_max_err,
-								'dist_max': dist_max,
-								'dist_max_err': dist_max_err,
-								'massimo': massimo,
-								'massimo_err': massimo_err,
-								'color': materiali[materiale][4]}	
+			k = np.argmax(errore)
+
+			if errore[k] < tol:
+				break
+
+			E_nuova = np.sqrt(Energie[k] * Energie[k+1])
+			Energie = np.insert(Energie, k + 1, E_nuova)
+
+			for materiale in materiali:
+
+				valori = _parametri_energia(E_nuova, materiali[materiale], s, tipo, n, librerie.get(materiale))
+
+				for chiave in CHIAVI:
+					risultati[materiale][chiave].insert(k + 1, valori[chiave])
+
+			n_sim += n * len(materiali)
+
+	for materiale in materiali:
+		risultati[materiale]['color'] = materiali[materiale][4]
 								
 	return Energie, risultati
@@ -0,0 +1,239 @@
+"""
+Modulo libreria_sciame.py
+
+Contiene una classe per le librerie di sottosciami pre-simulati e le funzioni per costruirle, salvarle e caricarle.
+Durante la simulazione ogni particella con energia inferiore alla soglia della libreria viene sostituita
+da un profilo estratto a caso dalla libreria, traslato alla profondità in cui si trova la particella.
+"""
+
+import numpy as np
+import sciame
+
+class LibreriaSciami:
+
+	"""
+	Rappresenta una libreria di profili di sottosciami per un materiale e un passo di simulazione.
+
+	Attributi:
+
+	parametri (np.array): Parametri della simulazione [ec_elettrone, ec_positrone, dE_X0, X0, s]
+	bordi (np.array): Bordi dei bin di energia della libreria, spaziati logaritmicamente [MeV]
+	campioni (dict): Per ogni coppia (tipo, bin) una lista di tuple (E, E_ion, conteggi) con l'energia iniziale
+		del sottosciame [MeV], l'energia depositata in ogni step [MeV] e il numero di particelle di ogni tipo
+		(nell'ordine di sciame.TIPI) in ogni step
+
+	Metodi:
+
+	compatibile: Verifica che la libreria sia stata costruita con i parametri di simulazione dati
+	estrai: Estrae un profilo per una particella di tipo ed energia dati
+	salva: Salva la libreria su disco
+	"""
+
+	def __init__(self, parametri, bordi, campioni):
+
+		self.parametri = np.asarray(parametri, dtype = float)
+		self.bordi = np.asarray(bordi, dtype = float)
+		self.campioni = campioni
+
+	def compatibile(self, ec_elettrone, ec_positrone, dE_X0, X0, s):
+
+		"""
+		Verifica che la libreria sia stata costruita con i parametri di simulazione dati.
+
+		Parametri:
+
+		ec_elettrone (float): Energia critica per gli elettroni nel materiale in esame [MeV]
+		ec_positrone (float): Energia critica per i positroni nel materiale in esame [MeV]
+		dE_X0 (float): Perdita per ionizzazione in una lunghezza di radiazione [MeV/cm]
+		X0 (float): Lunghezza di radiazione [cm]
+		s (float): Passo di avanzamento della simulazione in frazioni di X0 (s in (0, 1])
+
+		Ritorna:
+
+		(bool): True se i parametri coincidono con quelli della libreria
+		"""
+
+		return bool(np.allclose(self.parametri, [ec_elettrone, ec_positrone, dE_X0, X0, s]))
+
+	def estrai(self, tipo, E):
+
+		"""
+		Estrae a caso un profilo dal bin di energia della particella.
+		L'energia depositata viene riscalata di E/E_campione: sopra l'intervallo delle energie di taglio del modello
+		(vedi costruisci_libreria) la frazione di energia non depositata è circa costante (~2%) e quindi scala con E.
+
+		Parametri:
+
+		tipo (str): Tipo della particella (elettrone, positrone, fotone)
+		E (float): Energia della particella [MeV]
+
+		Ritorna:
+
+		profilo (tuple): (E_ion, conteggi) con l'energia depositata in ogni step [MeV] e il numero di particelle di ogni tipo
+			in ogni step, a partire dallo step in cui si trova la particella. None se E è fuori dall'intervallo della libreria.
+		"""
+
+		if E < self.bordi[0] or E >= self.bordi[-1]:
+			return None
+
+		k = np.searchsorted(self.bordi, E, side = 'right') - 1
+		lista = self.campioni[(tipo, k)]
+		E_campione, E_ion, conteggi = lista[np.random.randint(len(lista))]
+
+		return E_ion * (E / E_campione), conteggi
+
+	def salva(self, percorso):
+
+		"""
+		Salva la libreria su disco in formato .npz.
+
+		Parametri:
+
+		percorso (str): Percorso del file
+
+		Ritorna:
+
+		None
+		"""
+
+		chiavi = sorted(self.campioni, key = lambda chiave: (sciame.TIPI.index(chiave[0]), chiave[1]))
+
+		tipo_campioni = []
+		bin_campioni = []
+		E_campioni = []
+		lunghezze = []
+		E_ion = []
+		conteggi = []
+
+		for tipo, k in chiavi:
+			for E_campione, E_prof, n_prof in self.campioni[(tipo, k)]:
+
+				tipo_campioni.append(sciame.TIPI.index(tipo))
+				bin_campioni.append(k)
+				E_campioni.append(E_campione)
+				lunghezze.append(len(E_prof))
+				E_ion.append(E_prof)
+				conteggi.append(n_prof)
+
+		np.savez_compressed(percorso,
+							parametri = self.parametri,
+							bordi = self.bordi,
+							tipo_campioni = np.array(tipo_campioni),
+							bin_campioni = np.array(bin_campioni),
+							E_campioni = np.array(E_campioni),
+							lunghezze = np.array(lunghezze),
+							E_ion = np.concatenate(E_ion),
+							conteggi = np.concatenate(conteggi, axis = 1))
+
+
+
+def costruisci_libreria(ec_elettrone, ec_positrone, dE_X0, X0, s, E_soglia, E_min = None, n_bin = 100, n_campioni = 500):
+
+	"""
+	Costruisce una libreria simulando n_campioni sottosciami per ogni tipo di particella e per ogni bin di energia.
+	I bin sono spaziati logaritmicamente tra E_min ed E_soglia e l'energia di ogni sottosciame è estratta
+	in modo uniforme in scala logaritmica all'interno del bin. Il numero di particelle dei profili non viene riscalato
+	con l'energia, per cui bin troppo larghi introducono una distorsione nel numero massimo di particelle.
+
+	Poiché gli stessi n_campioni profili vengono riutilizzati in tutti gli sciami, la libreria introduce un errore
+	sistematico che non diminuisce con il numero di sciami simulati e non è incluso negli errori standard calcolati
+	da analisi_sciame. In particolare la distanza massima raggiunta ('dist_max') può risultare sottostimata, poiché le code
+	più lunghe dei sottosciami sono rappresentate solo da n_campioni profili per bin.
+
+	Sotto circa due volte l'energia critica la frazione di energia non depositata varia bruscamente con l'energia
+	(da ~50% sotto le soglie di 1.24 MeV per elettroni e 2 * 0.511 MeV per fotoni, a meno dell'1% tra 5 e 10 MeV),
+	per cui un riscalamento all'interno del bin introdurrebbe una distorsione nell'energia depositata. Per questo
+	E_min vale di default 2 * max(ec_elettrone, ec_positrone) e le particelle di energia inferiore vengono simulate.
+
+	Resta una differenza nell'energia totale depositata dell'ordine di 1e-4-3e-4 in valore relativo (fino a qualche
+	sigma con n >= 1000 sciami): poiché la perdita per ionizzazione in ogni passo è fissa e le energie vengono
+	dimezzate esattamente, le particelle di uno sciame occupano energie discrete la cui frazione non depositata
+	differisce leggermente da quella media dei profili della libreria. Per NaI (s = 0.1, E_soglia = 300 MeV) il numero
+	massimo di particelle, la sua posizione e la distanza massima raggiunta sono risultati compatibili con la
+	simulazione completa entro ~3 sigma per elettroni, positroni e fotoni tra 1e3 e 1e5 MeV.
+
+	Il costo di costruzione è di 3 * n_bin * n_campioni sciami (150000 con i valori di default) e la memoria
+	occupata cresce allo stesso modo: conviene costruire la libreria una volta sola, salvarla e riutilizzarla.
+
+	Parametri:
+
+	ec_elettrone (float): Energia critica per gli elettroni nel materiale in esame [MeV]
+	ec_positrone (float): Energia critica per i positroni nel materiale in esame [MeV]
+	dE_X0 (float): Perdita per ionizzazione in una lunghezza di radiazione [MeV/cm]
+	X0 (float): Lunghezza di radiazione [cm]
+	s (float): Passo di avanzamento della simulazione in frazioni di X0 (s in (0, 1])
+	E_soglia (float): Energia sotto la quale le particelle vengono sostituite dai profili della libreria [MeV]
+	E_min (float, opzionale): Energia minima della libreria, le particelle con energia inferiore vengono simulate
+		(default: 2 * max(ec_elettrone, ec_positrone)) [MeV]
+	n_bin (int, opzionale): Numero di bin di energia
+	n_campioni (int, opzionale): Numero di sottosciami simulati per ogni tipo e bin
+
+	Ritorna:
+
+	libreria (LibreriaSciami): Libreria dei profili simulati
+	"""
+
+	if E_min is None:
+		E_min = 2 * max(ec_elettrone, ec_positrone)
+
+	if E_min <= 0 or E_soglia <= E_min:
+		raise ValueError("Inserire valori di energia positivi con 'E_min' < 'E_soglia'")
+
+	if n_bin <= 0 or n_campioni <= 0:
+		raise ValueError("'n_bin' e 'n_campioni' devono essere entrambi positivi")
+
+	bordi = np.logspace(np.log10(E_min), np.log10(E_soglia), n_bin + 1)
+	campioni = {}
+
+	for tipo in sciame.TIPI:
+		for k in range(n_bin):
+
+			campioni[(tipo, k)] = []
+
+			for j in range(n_campioni):
+
+				E_campione = 10**np.random.uniform(np.log10(bordi[k]), np.log10(bordi[k+1]))
+
+				E_prof = []
+				n_prof = []
+
+				for record in sciame.simulazione_passi(E_campione, ec_elettrone, ec_positrone, dE_X0, s, tipo, X0):
+
+					E_prof.append(record['E_ion'])
+					n_prof.append([record['conteggi'][t] for t in sciame.TIPI])
+
+				campioni[(tipo, k)].append((E_campione, np.array(E_prof, dtype = float), np.array(n_prof, dtype = np.int32).T))
+
+	return LibreriaSciami([ec_elettrone, ec_positrone, dE_X0, X0, s], bordi, campioni)
+
+
+
+def carica_libreria(percorso):
+
+	"""
+	Carica una libreria salvata con LibreriaSciami.salva.
+
+	Parametri:
+
+	percorso (str): Percorso del file
+
+	Ritorna:
+
+	libreria (LibreriaSciami): Libreria caricata
+	"""
+
+	with np.load(percorso) as dati:
+		dati = {chiave: dati[chiave] for chiave in dati.files}
+
+	inizio = np.concatenate(([0], np.cumsum(dati['lunghezze'])))
+	campioni = {(tipo, k): [] for tipo in sciame.TIPI for k in range(len(dati['bordi']) - 1)}
+
+	for i in range(len(dati['E_campioni'])):
+
+		tipo = sciame.TIPI[dati['tipo_campioni'][i]]
+		E_prof = dati['E_ion'][inizio[i]:inizio[i+1]]
+		n_prof = dati['conteggi'][:, inizio[i]:inizio[i+1]]
+
+		campioni[(tipo, int(dati['bin_campioni'][i]))].append((dati['E_campioni'][i], E_prof, n_prof))
+
+	return LibreriaSciami(dati['parametri'], dati['bordi'], campioni)
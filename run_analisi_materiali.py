@@ -18,10 +18,19 @@ Parametri accettati (argparse):
     s (float): Passo di avanzamento in frazioni di X0 (s in (0,1])
     tipo (str): Tipo di particella iniziale (elettrone, positrone, fotone)
     --singoli (flag): Se presente, i grafici vengono mostrati singolarmente, non sovrapposti
+    --adattivo (flag): Se presente, la griglia di nE energie viene raffinata in modo adattivo
+    --tol (float): Errore di interpolazione relativo massimo accettato nella modalità adattiva
+    --n_sim_max (int): Numero massimo di simulazioni totali nella modalità adattiva
+    --libreria (str): Cartella delle librerie di sottosciami pre-simulati, create se assenti e riutilizzate nelle esecuzioni successive.
+        La costruzione richiede 150000 sciami per materiale e viene saltata se E0_max <= E_soglia
+    --E_soglia (float): Energia sotto la quale le particelle vengono sostituite dai profili della libreria [MeV]
 """
 
 import argparse
+import os
+import numpy as np
 import analisi_sciame as an
+import libreria_sciame as lib
 import plot_sciame as plot
 
 parser = argparse.ArgumentParser(description='Simulazione sciami elettromagnetici')
@@ -32,6 +41,11 @@ parser.add_argument('nE', type = int, help = "Numero di valori di energia nell'i
 parser.add_argument('s', type = float , help = 'Passo di avanzamento in frazioni di X0')
 parser.add_argument('tipo', type = str, help = 'Tipo di particella iniziale (elettrone, positrone fotone)')
 parser.add_argument('--singoli', action = 'store_true', help = 'I grafici dei materiali vengono visualizzati singolarmente, non sovrapposti')
+parser.add_argument('--adattivo', action = 'store_true', help = 'La griglia di energie viene raffinata dove i parametri variano più rapidamente')
+parser.add_argument('--tol', type = float, default = 0.05, help = 'Errore di interpolazione relativo massimo accettato nella modalità adattiva')
+parser.add_argument('--n_sim_max', type = int, default = None, help = 'Numero massimo di simulazioni totali nella modalità adattiva')
+parser.add_argument('--libreria', type = str, default = None, help = 'Cartella delle librerie di sottosciami pre-simulati (create se assenti, con un costo di 150000 sciami per materiale)')
+parser.add_argument('--E_soglia', type = float, default = 300, help = 'Energia sotto la quale le particelle vengono sostituite dai profili della libreria [MeV]')
 args = parser.parse_args()
 
 #materiali = {'materiale': [ec_elettrone, ec_positrone, dE_X0, X0, color]}
@@ -39,7 +53,28 @@ materiali = {'NaI': [13.37, 12.94, 4.785, 2.588, 'navy'],
 			 'Standard rock': [49.13, 47.74, 4.472, 10.02, 'green']
 			 }
 
-Energie, risultati = an.sciame_stat(args.E0_min, args.E0_max, materiali, args.s, args.tipo, args.nE, args.n)
+librerie = {}
+
+if args.libreria is not None and args.E0_max <= args.E_soglia:
+	print(f"E0_max <= E_soglia ({args.E_soglia} MeV): la libreria di sottosciami non viene utilizzata")
+
+elif args.libreria is not None:
+	
+	os.makedirs(args.libreria, exist_ok = True)
+	
+	for materiale in materiali:
+		
+		ec_elettrone, ec_positrone, dE_X0, X0 = materiali[materiale][:4]
+		percorso = os.path.join(args.libreria, f'{materiale}.npz')
+		
+		if os.path.exists(percorso):
+			librerie[materiale] = lib.carica_libreria(percorso)
+		
+		if materiale not in librerie or not librerie[materiale].compatibile(ec_elettrone, ec_positrone, dE_X0, X0, args.s) or not np.isclose(librerie[materiale].bordi[-1], args.E_soglia) or not np.isclose(librerie[materiale].bordi[0], 2 * max(ec_elettrone, ec_positrone)):
+			librerie[materiale] = lib.costruisci_libreria(ec_elettrone, ec_positrone, dE_X0, X0, args.s, args.E_soglia)
+			librerie[materiale].salva(percorso)
+
+Energie, risultati = an.sciame_stat(args.E0_min, args.E0_max, materiali, args.s, args.tipo, args.nE, args.n, args.adattivo, args.tol, args.n_sim_max, librerie)
 
 if not args.singoli:
 	plot.confronto_materiali(Energie, risultati)
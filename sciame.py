@@ -5,6 +5,9 @@ Contiene classi per particelle (elettroni e positroni) e fotoni, e una funzione
 """
 
 import numpy as np
+from bisect import bisect_right
+
+TIPI = ['elettrone', 'positrone', 'fotone']
 		
 class Particella:
 	
@@ -209,10 +212,42 @@ class Fotone:
 		return E_ion
 		
 
-def simulazione(E0, ec_elettrone, ec_positrone, dE_X0, s, tipo, X0):
+def riempi_spettro(sciame, bordi, spettro):
+	
+	"""
+	Aggiunge le particelle dello sciame all'istogramma in energia, separando i diversi tipi di particella.
+	L'istogramma viene aggiornato sul posto, senza creare strutture che dipendono dal numero di particelle.
+	
+	Parametri:
+	
+	sciame (list): Lista delle particelle o fotoni presenti nello step
+	bordi (list): Bordi dei bin di energia, strettamente crescenti [MeV]
+	spettro (np.array): Istogramma di forma (len(TIPI), len(bordi) - 1) da aggiornare
+	
+	Ritorna:
+	
+	None
+	"""
+	
+	n_bin = len(bordi) - 1
+	
+	for part in sciame:
+		
+		k = bisect_right(bordi, part.E) - 1
+		
+		if k == n_bin and part.E == bordi[-1]:
+			k = n_bin - 1
+		
+		if 0 <= k < n_bin:
+			spettro[TIPI.index(part.tipo)][k] += 1
+		
+
+def simulazione_passi(E0, ec_elettrone, ec_positrone, dE_X0, s, tipo, X0, bordi = None, libreria = None, per_tipo = True):
 	
 	"""
-	Simula uno sciame elettromagnetico.
+	Simula uno sciame elettromagnetico restituendo un generatore che produce un record per ogni step.
+	Lo sciame avanza solo quando viene richiesto il record successivo: interrompendo l'iterazione
+	(ad esempio con break o itertools.islice) non vengono simulati gli step successivi.
 	
 	Parametri:
 	
@@ -223,17 +258,24 @@ def simulazione(E0, ec_elettrone, ec_positrone, dE_X0, s, tipo, X0):
 	s (float): Passo di avanzamento della simulazione in frazioni di X0 (s in (0, 1]) 
 	tipo (str): Tipo della particella iniziale (elettrone, positrone, fotone) 
 	X0 (float): Lunghezza di radiazione [cm]
+	bordi (array, opzionale): Bordi dei bin di energia degli spettri, strettamente crescenti (es. np.logspace) [MeV]
+	libreria (LibreriaSciami, opzionale): Libreria di sottosciami pre-simulati (vedi libreria_sciame). Le particelle secondarie con
+		energia nell'intervallo della libreria non vengono simulate ma sostituite da un profilo estratto dalla libreria.
+		La particella iniziale viene sempre simulata, anche se la sua energia è inferiore alla soglia della libreria
+	per_tipo (bool, opzionale): Se False i record non contengono 'conteggi', evitando di contare i tipi di particella ad ogni step
+	
 	Ritorna:
 	
-	E_step(list): Energia depositata per ionizzazione in ogni step [MeV]
-	n_part(list): Numero di particelle dello sciame in ogni step 
-	E_tot(float): Energia totale depositata per ionizzazione [MeV]
+	passi (generator): Produce per ogni step (a partire dallo step 0 con la sola particella iniziale) un dict contenente:
+		- 'passo' (int): Indice dello step
+		- 'E_ion' (float): Energia depositata per ionizzazione nello step [MeV]
+		- 'n_part' (int): Numero di particelle dello sciame alla fine dello step
+		- 'conteggi' (dict): Solo se 'per_tipo' è True. Numero di particelle per ogni tipo in TIPI
+		- 'spettro' (np.array): Solo se 'bordi' è specificato. Numero di particelle per tipo e bin di energia,
+		  di forma (len(TIPI), len(bordi) - 1)
 	"""
-
+	
 	sciame_i = []
-	sciame_f = []
-	n_part = [1]
-	E_step = [0]
 	
 	if E0 < 0 or ec_positrone < 0 or ec_elettrone < 0 or dE_X0 < 0:
 		raise ValueError('Inserire valori di energia positivi')
@@ -253,8 +295,110 @@ def simulazione(E0, ec_elettrone, ec_positrone, dE_X0, s, tipo, X0):
 	else:
 		raise ValueError("Inserire 'elettrone', 'positrone' o 'fotone' come particella iniziale")
 	
+	if bordi is not None:
+		
+		bordi = list(bordi)
+		
+		if len(bordi) < 2 or any(b2 <= b1 for b1, b2 in zip(bordi[:-1], bordi[1:])):
+			raise ValueError("I bordi dei bin devono essere almeno due e strettamente crescenti")
+	
+	if libreria is not None:
+		
+		if bordi is not None:
+			raise ValueError("Gli spettri in energia non sono disponibili se si utilizza una libreria di sottosciami")
+		
+		if not libreria.compatibile(ec_elettrone, ec_positrone, dE_X0, X0, s):
+			raise ValueError("La libreria di sottosciami è stata costruita con parametri diversi da quelli della simulazione")
+	
+	return _passi(sciame_i, ec_elettrone, ec_positrone, dE_X0, s, X0, bordi, libreria, per_tipo)
+
+
+
+def _passi(sciame_i, ec_elettrone, ec_positrone, dE_X0, s, X0, bordi, libreria, per_tipo):
+	
+	"""
+	Generatore degli step dello sciame usato da simulazione_passi, dopo il controllo dei parametri.
+	
+	Parametri:
+	
+	sciame_i (list): Lista delle particelle o fotoni presenti allo step iniziale
+	ec_elettrone, ec_positrone, dE_X0, s, X0, bordi, libreria, per_tipo: Vedi simulazione_passi
+	
+	Ritorna:
+	
+	passi (generator): Vedi simulazione_passi
+	"""
+	
+	sciame_f = []
+	passo = 0
+	E_ion = 0
+	
+	E_lib = np.zeros(0)						#Energia depositata e numero di particelle per tipo dei profili
+	n_lib = np.zeros((len(TIPI), 0), dtype = int)		#estratti dalla libreria, per ogni step
+	
+	primaria = sciame_i[0]			#La particella iniziale non viene mai sostituita dalla libreria
 	
-	while len(sciame_i) != 0:
+	while True:
+		
+		if libreria is not None:
+			
+			sciame_vivo = []
+			
+			for part in sciame_i:
+				
+				if part is primaria:
+					sciame_vivo.append(part)
+					continue
+				
+				profilo = libreria.estrai(part.tipo, part.E)
+				
+				if profilo is None:
+					sciame_vivo.append(part)
+				
+				else:
+					E_prof, n_prof = profilo
+					fine = passo + len(E_prof)
+					
+					if fine > len(E_lib):
+						E_lib = np.pad(E_lib, (0, fine - len(E_lib)))
+						n_lib = np.pad(n_lib, ((0, 0), (0, fine - n_lib.shape[1])))
+					
+					E_lib[passo:fine] += E_prof
+					n_lib[:, passo:fine] += n_prof
+			
+			sciame_i = sciame_vivo
+		
+		n_part = len(sciame_i)
+		
+		if passo < len(E_lib):
+			E_ion += E_lib[passo]
+			n_part += int(np.sum(n_lib[:, passo]))
+		
+		record = {'passo': passo,
+				  'E_ion': E_ion,
+				  'n_part': n_part}
+		
+		if per_tipo:
+			
+			conteggi = {t: 0 for t in TIPI}
+			
+			for part in sciame_i:
+				conteggi[part.tipo] += 1
+			
+			if passo < len(E_lib):
+				for k, t in enumerate(TIPI):
+					conteggi[t] += int(n_lib[k][passo])
+			
+			record['conteggi'] = conteggi
+		
+		if bordi is not None:
+			record['spettro'] = np.zeros((len(TIPI), len(bordi) - 1))
+			riempi_spettro(sciame_i, bordi, record['spettro'])
+		
+		yield record
+		
+		if len(sciame_i) == 0 and passo >= len(E_lib) - 1:
+			return
 		
 		E_ion = 0
 		
@@ -262,13 +406,53 @@ def simulazione(E0, ec_elettrone, ec_positrone, dE_X0, s, tipo, X0):
 			
 			E_ion = part.step(s, sciame_f, E_ion, ec_elettrone, ec_positrone, dE_X0, X0)	
 		
-		E_step.append(E_ion)
-		
-		n_part.append(len(sciame_f))
+		passo += 1
 		
 		sciame_i = sciame_f
-		sciame_f = []			
+		sciame_f = []
+		
+
+
+def simulazione(E0, ec_elettrone, ec_positrone, dE_X0, s, tipo, X0, bordi = None, libreria = None):
+	
+	"""
+	Simula uno sciame elettromagnetico fino al suo esaurimento.
+	
+	Parametri:
+	
+	E0 (float): Energia della particella iniziale [MeV]
+	ec_elettrone (float): Energia critica per gli elettroni nel materiale in esame [MeV]
+	ec_positrone (float): Energia critica per i positroni nel materiale in esame [MeV]
+	dE_X0 (float): Perdita per ionizzazione in una lunghezza di radiazione [MeV/cm]
+	s (float): Passo di avanzamento della simulazione in frazioni di X0 (s in (0, 1]) 
+	tipo (str): Tipo della particella iniziale (elettrone, positrone, fotone) 
+	X0 (float): Lunghezza di radiazione [cm]
+	bordi (array, opzionale): Bordi dei bin di energia degli spettri, strettamente crescenti (es. np.logspace) [MeV]
+	libreria (LibreriaSciami, opzionale): Libreria di sottosciami pre-simulati, vedi simulazione_passi
+	Ritorna:
+	
+	E_step(list): Energia depositata per ionizzazione in ogni step [MeV]
+	n_part(list): Numero di particelle dello sciame in ogni step 
+	E_tot(float): Energia totale depositata per ionizzazione [MeV]
+	spettri(np.array): Solo se 'bordi' è specificato. Numero di particelle per ogni step, tipo (nell'ordine di TIPI) e bin di energia,
+		di forma (len(n_part), len(TIPI), len(bordi) - 1). Le particelle con energia fuori dai bordi non vengono contate.
+	"""
+
+	n_part = []
+	E_step = []
+	spettri = []
+	
+	for record in simulazione_passi(E0, ec_elettrone, ec_positrone, dE_X0, s, tipo, X0, bordi, libreria, per_tipo = False):
+		
+		E_step.append(record['E_ion'])
+		n_part.append(record['n_part'])
+		
+		if bordi is not None:
+			spettri.append(record['spettro'])
 	
 	E_tot = np.sum(E_step)
 	
+	if bordi is not None:
+		return E_step, n_part, E_tot, np.array(spettri)
+	
 	return E_step, n_part, E_tot